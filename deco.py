@@ -2,6 +2,12 @@
 # -*- coding: utf-8 -*-
 
 from functools import update_wrapper, WRAPPER_ASSIGNMENTS, WRAPPER_UPDATES
+from time import perf_counter_ns
+import asyncio
+import contextvars
+import inspect
+import json
+import threading
 
 
 def disable(func):
@@ -27,11 +33,20 @@ def decorator(wrapped):
 
 
 def countcalls(func):
-    '''Decorator that counts calls made to the function decorated.'''
-    @decorator(func)
-    def wrapper(*args):
-        wrapper.calls += 1
-        return func(*args)
+    '''
+    Decorator that counts calls made to the function decorated.
+    Coroutine functions are wrapped into coroutine functions.
+    '''
+    if inspect.iscoroutinefunction(func):
+        @decorator(func)
+        async def wrapper(*args):
+            wrapper.calls += 1
+            return await func(*args)
+    else:
+        @decorator(func)
+        def wrapper(*args):
+            wrapper.calls += 1
+            return func(*args)
     wrapper.calls = 0
     return wrapper
 
@@ -40,7 +55,14 @@ def memo(func):
     '''
     Memoize a function so that it caches all return values for
     faster future lookups.
+
+    For coroutine functions awaited results are cached. Concurrent
+    calls with the same arguments share one in-flight call, failed
+    calls are not cached.
     '''
+    if inspect.iscoroutinefunction(func):
+        return async_memo(func)
+
     cache = dict()
 
     @decorator(func)
@@ -52,20 +74,72 @@ def memo(func):
             return result
         except TypeError:
             # some element of args can't be a dict key
-            return func(args)
+            return func(*args)
 
     # print(f"memo {wrapper}, __dict__ {wrapper.__dict__}")
     return wrapper
 
-def n_ary(func):
+
+def async_memo(func):
+    '''
+    Memoize a coroutine function. Callers waiting for the same
+    arguments await one shared task, so the backend is called once.
+    '''
+    cache = dict()
+    pending = dict()
+
+    def settle(args, task):
+        del pending[args]
+        if not task.cancelled() and task.exception() is None:
+            cache[args] = task.result()
+
+    @decorator(func)
+    async def wrapper(*args):
+        try:
+            return cache[args]
+        except KeyError:
+            pass
+        except TypeError:
+            # some element of args can't be a dict key
+            return await func(*args)
+
+        try:
+            task = pending[args]
+        except KeyError:
+            task = pending[args] = asyncio.ensure_future(func(*args))
+            task.add_done_callback(lambda t: settle(args, t))
+        # a cancelled caller must not cancel the call shared with others
+        return await asyncio.shield(task)
+
+    return wrapper
+
+
+def n_ary(func=None, *, memoize=False):
     '''
     Given binary function f(x, y), return an n_ary function such
     that f(x, y, z) = f(x, f(y,z)), etc. Also allow f(x) = x.
+
+    Arguments are folded from the right without recursion, so any
+    number of arguments is supported. With memoize=True only the
+    full call is cached, not the intermediate suffixes:
+
+    @n_ary(memoize=True)
+    def add(a, b):
+        ....
+
     '''
+    if func is None:
+        return lambda f: n_ary(f, memoize=memoize)
+
     @decorator(func)
     def n_ary_f(x, *args):
-        return x if not args else func(x, n_ary_f(*args))
-    return n_ary_f
+        if not args:
+            return x
+        result = args[-1]
+        for arg in args[-2::-1]:
+            result = func(arg, result)
+        return func(x, result)
+    return memo(n_ary_f) if memoize else n_ary_f
 
 
 def trace(indent):
@@ -105,6 +179,212 @@ def trace(indent):
     return decorate
 
 
+class ProfileStats:
+    '''Call statistics of a profiled function, times are in nanoseconds.
+
+    Cumulative time is added by outermost sampled calls only (primitive
+    calls), so recursion doesn't count the same time more than once.
+    '''
+    __slots__ = ('calls', 'sampled', 'primitive', 'cum_ns', 'self_ns', 'max_ns', 'histogram')
+
+    def __init__(self, histogram=False):
+        self.calls = 0
+        self.sampled = 0
+        self.primitive = 0
+        self.cum_ns = 0
+        self.self_ns = 0
+        self.max_ns = 0
+        # bucket k counts sampled calls that took less than 2**k ns
+        self.histogram = dict() if histogram else None
+
+    def add(self, elapsed, self_elapsed, outermost):
+        self.sampled += 1
+        if outermost:
+            self.primitive += 1
+            self.cum_ns += elapsed
+        self.self_ns += self_elapsed
+        if elapsed > self.max_ns:
+            self.max_ns = elapsed
+        if self.histogram is not None:
+            bucket = elapsed.bit_length()
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def as_dict(self):
+        stats = {
+            "calls": self.calls,
+            "sampled": self.sampled,
+            "primitive": self.primitive,
+            "cum_ns": self.cum_ns,
+            "self_ns": self.self_ns,
+            "max_ns": self.max_ns,
+            "avg_ns": self.cum_ns // self.primitive if self.primitive else 0,
+        }
+        if self.histogram is not None:
+            stats["histogram"] = {str(1 << k): self.histogram[k] for k in sorted(self.histogram)}
+        return stats
+
+
+profile_registry = dict()
+_profile_local = threading.local()
+# stats of coroutine functions being awaited in the current context
+_profile_awaiting = contextvars.ContextVar('profile_awaiting', default=frozenset())
+
+
+class _ProfileFrame:
+    '''
+    Time a sampled call of a profiled function. A frame can be entered
+    several times (once per generator step), times are accumulated.
+    '''
+    __slots__ = ('stats', 'stack', 'active', 'outermost', 'added', 'start', 'elapsed', 'self_elapsed')
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.outermost = None
+        self.elapsed = 0
+        self.self_elapsed = 0
+
+    def __enter__(self):
+        try:
+            self.stack = _profile_local.stack
+            self.active = _profile_local.active
+        except AttributeError:
+            self.stack = _profile_local.stack = []
+            # stats of functions with a sampled call in progress
+            self.active = _profile_local.active = set()
+        # time spent in nested sampled calls
+        self.stack.append(0)
+        self.added = self.stats not in self.active
+        if self.added:
+            self.active.add(self.stats)
+        if self.outermost is None:
+            self.outermost = self.added
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = perf_counter_ns() - self.start
+        nested = self.stack.pop()
+        if self.stack:
+            self.stack[-1] += elapsed
+        if self.added:
+            self.active.discard(self.stats)
+        self.elapsed += elapsed
+        self.self_elapsed += elapsed - nested
+
+    def record(self):
+        if self.outermost is not None:
+            self.stats.add(self.elapsed, self.self_elapsed, self.outermost)
+
+
+def profile(sample_rate=1, histogram=False, name=None):
+    '''Profile calls made to function decorated.
+
+    Every call is counted, every sample_rate-th call is timed with
+    perf_counter_ns. Self time excludes time spent in nested profiled
+    calls that were sampled too. Statistics are kept in profile_registry
+    under the function's qualified name, which must be unique.
+
+    For generator functions the time of all steps of the iteration is
+    timed as one call, counted when iteration starts. For coroutine
+    functions the await is timed and self time is the same wall time,
+    since waiting can't be split between tasks.
+
+    @profile(sample_rate=10, histogram=True)
+    def parse(line):
+        ....
+
+    # >>> print(profile_json(indent=2))
+
+    '''
+    if not isinstance(sample_rate, int) or sample_rate < 1:
+        raise ValueError(f'sample_rate must be a positive integer, got {sample_rate!r}')
+
+    def decorate(func):
+        key = name or f'{func.__module__}.{func.__qualname__}'
+        if key in profile_registry:
+            raise ValueError(f'{key} is already profiled, pass another name')
+        stats = profile_registry[key] = ProfileStats(histogram)
+
+        if inspect.iscoroutinefunction(func):
+            @decorator(func)
+            async def wrapper(*args, **kwargs):
+                stats.calls += 1
+                if stats.calls % sample_rate:
+                    return await func(*args, **kwargs)
+
+                awaiting = _profile_awaiting.get()
+                token = _profile_awaiting.set(awaiting | {stats})
+                start = perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    elapsed = perf_counter_ns() - start
+                    _profile_awaiting.reset(token)
+                    stats.add(elapsed, elapsed, stats not in awaiting)
+            return wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @decorator(func)
+            def wrapper(*args, **kwargs):
+                stats.calls += 1
+                if stats.calls % sample_rate:
+                    return (yield from func(*args, **kwargs))
+
+                frame = _ProfileFrame(stats)
+                try:
+                    with frame:
+                        gen = func(*args, **kwargs)
+                    send, value = gen.send, None
+                    while True:
+                        try:
+                            with frame:
+                                item = send(value)
+                        except StopIteration as e:
+                            return e.value
+                        try:
+                            value, send = (yield item), gen.send
+                        except GeneratorExit:
+                            with frame:
+                                gen.close()
+                            raise
+                        except BaseException as e:
+                            value, send = e, gen.throw
+                finally:
+                    frame.record()
+            return wrapper
+
+        @decorator(func)
+        def wrapper(*args, **kwargs):
+            stats.calls += 1
+            if stats.calls % sample_rate:
+                return func(*args, **kwargs)
+
+            frame = _ProfileFrame(stats)
+            try:
+                with frame:
+                    return func(*args, **kwargs)
+            finally:
+                frame.record()
+        return wrapper
+    return decorate
+
+
+def profile_stats():
+    '''Return statistics of all profiled functions as a dict.'''
+    return {name: stats.as_dict() for name, stats in profile_registry.items()}
+
+
+def profile_json(**kwargs):
+    '''Export statistics of all profiled functions as JSON.'''
+    return json.dumps(profile_stats(), **kwargs)
+
+
+def profile_reset():
+    '''Reset statistics of all profiled functions.'''
+    for stats in profile_registry.values():
+        stats.__init__(stats.histogram is not None)
+
+
 @memo
 @countcalls
 @n_ary
@@ -119,6 +399,11 @@ def bar(a, b):
     return a * b
 
 
+@n_ary(memoize=True)
+def add(a, b):
+    return a + b
+
+
 @countcalls
 @memo
 @trace("####")
@@ -127,6 +412,14 @@ def fib(n):
     return 1 if n <= 1 else fib(n-1) + fib(n-2)
 
 
+@memo
+@countcalls
+async def fetch(key):
+    """Some slow backend call"""
+    await asyncio.sleep(0.01)
+    return key * 10
+
+
 def main():
     print(foo(4, 3))
     print(foo(4, 3, 2))
@@ -138,10 +431,28 @@ def main():
     print(bar(4, 3, 2, 1))
     print("bar was called", bar.calls, "times")
 
+    print(add(*range(100000)))
+    print(add([1], [2], [3]))
+
     print(fib.__doc__)
     fib(3)
     print(fib.calls, 'calls made')
 
+    async def fetch_all():
+        return await asyncio.gather(fetch(1), fetch(1), fetch(2))
+
+    print(asyncio.run(fetch_all()))
+    print(asyncio.run(fetch_all()))
+    print("fetch was called", fetch.calls, "times")
+
+    @profile(histogram=True)
+    def fact(n):
+        return 1 if n <= 1 else n * fact(n-1)
+
+    for n in range(10):
+        fact(n)
+    print(profile_json(indent=2))
+
 
 if __name__ == '__main__':
     main()
@@ -9,6 +9,7 @@ import statistics
 from os import listdir, path, makedirs
 from datetime import datetime
 from collections import namedtuple
+from functools import lru_cache
 import re
 import logging
 import gzip
@@ -17,22 +18,57 @@ import configparser
 import itertools
 from string import Template
 import json
+import os
+import time
+import select
+import signal
+import socket
+import stat
+import struct
+import threading
+import ctypes
+import ctypes.util
 
 config = {
     "REPORT_SIZE": 1000,
     "REPORT_DIR": "./reports",
     "LOG_DIR": "./log",
     "ERROR_LIMIT": 0.5,
+    "POLL_INTERVAL": 60,
+    "SETTLE_INTERVAL": 5,
+    "SOCKET": "./log_analyzer.sock",
 }
 
 Log = namedtuple('Log', 'name date ext')
 
+LOG_FORMAT = re.compile(r'(?:\S+) (?:\S+)  (?:\S+) '
+                        r'(?:\[.+?\]) "(?:\S+) (?P<url>\S+) (?:\S+)" '
+                        r'(?:\d+) (?:\d+) "(?:.+?)" '
+                        r'"(?:.+?)" "(?:.+?)" '
+                        r'"(?:.+?)" "(?:.+?)" (?P<request_time>\S+)')
+
+# inotify events of a file appearing in the watched directory
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+# inotify events after which the watch has to be re-created
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+# struct inotify_event header: wd, mask, cookie, len
+INOTIFY_EVENT = struct.Struct('iIII')
+
 
 class ParseError(Exception):
     """Raised when parse error limit exceeded or some exception occurs while reading log file"""
     pass
 
 
+class DaemonError(Exception):
+    """Raised when log analyzer daemon can't be started"""
+    pass
+
+
 def to_date(s: str) -> datetime:
     try:
         return datetime.strptime(s, "%Y%m%d")
@@ -40,27 +76,31 @@ def to_date(s: str) -> datetime:
         return None
 
 
-def get_log(log_dir) -> Log:
+def get_logs(log_dir) -> list:
+    """Return logs sorted by date, text log is preferred to gzip log of the same date"""
 
     if not path.isdir(log_dir):
-        return None
+        return []
 
-    files = (
-        Log(name=f, date=dt, ext=m.groupdict()["ext"]) for f in sorted(listdir(log_dir))
-        if (m := re.match(r'nginx-access-ui.log-(?P<logdate>[0-9]{8})(?P<ext>\.gz)?', f))
-           and (dt := to_date(m.groupdict()['logdate'])) is not None
-    )
+    logs = {}
+    for f in sorted(listdir(log_dir)):
+        if (m := re.match(r'nginx-access-ui.log-(?P<logdate>[0-9]{8})(?P<ext>\.gz)?', f)) \
+                and (dt := to_date(m.groupdict()['logdate'])) is not None:
+            logs.setdefault(dt, Log(name=f, date=dt, ext=m.groupdict()["ext"]))
 
-    return max(files, default=None, key=lambda x: x.date)
+    return sorted(logs.values(), key=lambda x: x.date)
 
 
-def parse_log(source, error_limit):
+def get_log(log_dir) -> Log:
+    logs = get_logs(log_dir)
+    return logs[-1] if logs else None
+
 
-    log_format = re.compile(r'(?:\S+) (?:\S+)  (?:\S+) ' \
-                            r'(?:\[.+?\]) "(?:\S+) (?P<url>\S+) (?:\S+)" ' \
-                            r'(?:\d+) (?:\d+) "(?:.+?)" ' \
-                            r'"(?:.+?)" "(?:.+?)" ' \
-                            r'"(?:.+?)" "(?:.+?)" (?P<request_time>\S+)')
+def get_report_path(config: dict, log: Log) -> str:
+    return path.join(config["REPORT_DIR"], "report-" + datetime.strftime(log.date, "%Y.%m.%d") + ".html")
+
+
+def parse_log(source, error_limit):
 
     total_cnt = 0
     parsed_cnt = 0
@@ -70,7 +110,7 @@ def parse_log(source, error_limit):
         for line in source:
             total_cnt += 1
 
-            if m := log_format.match(line):
+            if m := LOG_FORMAT.match(line):
                 parsed_cnt += 1
                 yield m.groupdict()
             else:
@@ -90,13 +130,25 @@ def parse_log(source, error_limit):
         raise ParseError(f"Too many parse errors. Error percent: {pcnt}")
 
 
-def save_report(url_stats, report_path, template_path):
+@lru_cache
+def load_template(template_path) -> Template:
+    """Read report template once, daemon reuses it for every report"""
     with open(template_path, mode='r', encoding='windows-1251') as rt:
-        report_template = rt.read()
+        return Template(rt.read())
+
 
-    template = Template(report_template)
-    with open(report_path, mode='w', encoding='windows-1251') as report:
-        report.write(template.safe_substitute(table_json=json.dumps(url_stats)))
+def save_report(url_stats, report_path, template_path):
+    template = load_template(template_path)
+
+    # report appears only when completely written, interrupted run leaves no report
+    tmp_path = report_path + '.tmp'
+    try:
+        with open(tmp_path, mode='w', encoding='windows-1251') as report:
+            report.write(template.safe_substitute(table_json=json.dumps(url_stats)))
+        os.replace(tmp_path, report_path)
+    finally:
+        if path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 def render_report(parsed, report_size):
@@ -141,18 +193,17 @@ def render_report(parsed, report_size):
     # write top n items of url_stats to log
     top_n = 10
     logging.debug(f"Top {top_n} urls:")
-    for i in range(top_n):
+    for i in range(min(top_n, len(url_stats))):
         logging.debug(f"{url_stats[i]}")
 
     return url_stats
 
 
 def process_log(config: dict, log: Log, template_path: str):
-    report_name = "report-" + datetime.strftime(log.date, "%Y.%m.%d") + ".html"
     report_dir = config["REPORT_DIR"]
     logging.info(f"Start processing log {log.name}")
 
-    report_path = path.join(report_dir, report_name)
+    report_path = get_report_path(config, log)
     if path.isfile(report_path):
         logging.info(f'Report {report_path} already exists.')
         return
@@ -203,16 +254,275 @@ def configure(config_path, config):
             'ERROR': logging.ERROR
         }.get(logging_section.get('level', 'INFO'), 'INFO')
 
+    # daemon mode settings
+    if 'daemon' in config_parser:
+        daemon_section = config_parser['daemon']
+        config["POLL_INTERVAL"] = daemon_section.getfloat("POLL_INTERVAL", config["POLL_INTERVAL"])
+        config["SETTLE_INTERVAL"] = daemon_section.getfloat("SETTLE_INTERVAL", config["SETTLE_INTERVAL"])
+        config["SOCKET"] = daemon_section.get("SOCKET", config["SOCKET"])
+
     logging.basicConfig(filename=logging_filename,
                         level=logging_level,
                         format='[%(asctime)s] %(levelname).1s %(message)s',
                         datefmt='%Y.%m.%d %H:%M:%S')
 
 
+def analyze(config: dict, template_path: str) -> Log:
+    log = get_log(config["LOG_DIR"])
+    logging.debug(f'log = {log}')
+
+    if log is not None:
+        process_log(config, log, template_path)
+    else:
+        logging.info(f'No logs found')
+
+    return log
+
+
+def analyze_pending(config: dict, template_path: str, seen: dict):
+    """Process every log without report whose size and mtime are the same as on previous calls
+    for at least SETTLE_INTERVAL seconds, so logs still being written are skipped.
+    seen keeps size, mtime, time they were first seen and failure flag of pending logs between calls,
+    a log that failed is not processed again until it changes.
+    Return lists of processed logs, logs still changing and errors.
+    """
+    processed, unsettled, errors = [], [], []
+    current = {}
+    now = time.monotonic()
+
+    for log in get_logs(config["LOG_DIR"]):
+        if path.isfile(get_report_path(config, log)):
+            continue
+
+        st = os.stat(path.join(config["LOG_DIR"], log.name))
+        state = (st.st_size, st.st_mtime_ns)
+        previous, since, failed = seen.get(log.name, (None, now, False))
+        if previous != state:
+            since, failed = now, False
+        current[log.name] = (state, since, failed)
+        if failed:
+            continue
+        if previous != state or now - since < config["SETTLE_INTERVAL"]:
+            unsettled.append(log)
+            continue
+
+        try:
+            process_log(config, log, template_path)
+            processed.append(log)
+        except Exception as e:
+            logging.exception(e)
+            errors.append(f'{log.name}: {e}')
+            current[log.name] = (state, since, True)
+
+    seen.clear()
+    seen.update(current)
+    return processed, unsettled, errors
+
+
+class InotifyWatcher:
+    """Watch log directory for new files with Linux inotify"""
+    def __init__(self, log_dir):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MOVE_SELF
+        if libc.inotify_add_watch(self.fd, os.fsencode(log_dir), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f'inotify_add_watch failed for {log_dir}')
+        # watch was removed, log directory moved or events were lost
+        self.broken = False
+
+    def fileno(self):
+        return self.fd
+
+    def changed(self) -> bool:
+        """Drain pending events, return True if any file appeared"""
+        changed = False
+        try:
+            while data := os.read(self.fd, 65536):
+                changed = True
+                offset = 0
+                while offset < len(data):
+                    _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    if mask & (IN_IGNORED | IN_Q_OVERFLOW | IN_MOVE_SELF):
+                        self.broken = True
+                    offset += INOTIFY_EVENT.size + length
+        except BlockingIOError:
+            pass
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Watch log directory for new files by comparing directory listings"""
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self.missing = not path.isdir(log_dir)
+        self.snapshot = self.scan()
+
+    def scan(self):
+        try:
+            with os.scandir(self.log_dir) as entries:
+                return {(e.name, e.stat().st_size, e.stat().st_mtime_ns) for e in entries}
+        except OSError:
+            return set()
+
+    @property
+    def broken(self) -> bool:
+        """Log directory appeared, so inotify watcher can be created"""
+        return self.missing and path.isdir(self.log_dir)
+
+    def fileno(self):
+        return None
+
+    def changed(self) -> bool:
+        snapshot = self.scan()
+        changed, self.snapshot = snapshot != self.snapshot, snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def make_watcher(log_dir):
+    try:
+        return InotifyWatcher(log_dir)
+    except (OSError, AttributeError) as e:
+        # no inotify on this platform or log directory doesn't exist yet
+        logging.info(f'inotify is not available ({e}), polling {log_dir}')
+        return PollingWatcher(log_dir)
+
+
+def open_status_socket(socket_path) -> socket.socket:
+    if path.lexists(socket_path):
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            raise DaemonError(f'{socket_path} exists and is not a socket')
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(socket_path)
+            except ConnectionRefusedError:
+                # left by daemon that didn't exit cleanly
+                os.remove(socket_path)
+            else:
+                raise DaemonError(f'{socket_path} is used by another running daemon')
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+    return server
+
+
+def send_status(server, status):
+    """Accept one connection on status socket and write status as JSON line"""
+    conn, _ = server.accept()
+    with conn:
+        conn.settimeout(1)
+        try:
+            conn.sendall((json.dumps(status) + '\n').encode())
+        except OSError as e:
+            logging.debug(f'Status request failed: {e}')
+
+
+def serve_status(server, status):
+    """Write status to every client of status socket until the socket is closed"""
+    while True:
+        try:
+            send_status(server, status)
+        except OSError:
+            return
+
+
+def run_analyze(config, template_path, seen, status) -> list:
+    """Process pending logs, update status and return logs still changing"""
+    status["status"] = "running"
+    start = time.perf_counter()
+    try:
+        processed, unsettled, errors = analyze_pending(config, template_path, seen)
+    except Exception as e:
+        logging.exception(e)
+        processed, unsettled, errors = [], [], [str(e)]
+
+    if processed:
+        status["last_log"] = processed[-1].name
+    status["status"] = "error" if errors else "ok"
+    status["errors"] += len(errors)
+    if errors:
+        status["last_error"] = '; '.join(errors)
+    status["failed_logs"] = sorted(name for name, (_, _, failed) in seen.items() if failed)
+    status["runs"] += 1
+    status["last_run"] = datetime.now().isoformat(timespec='seconds')
+    status["last_duration"] = round(time.perf_counter() - start, 3)
+    return unsettled
+
+
+def serve(config: dict, template_path: str):
+    """Process new logs as they appear in LOG_DIR until terminated.
+    LOG_DIR is rescanned on every inotify event and at least every POLL_INTERVAL seconds.
+    A log is processed once its size and mtime stay the same for SETTLE_INTERVAL seconds.
+    Health and last run metrics are written as JSON to every client of SOCKET
+    from a separate thread, so they are available while a log is processed.
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: exit(0))
+
+    server = open_status_socket(config["SOCKET"])
+    socket_stat = os.stat(config["SOCKET"])
+    watcher = make_watcher(config["LOG_DIR"])
+    status = {
+        "status": "starting",
+        "pid": os.getpid(),
+        "started": datetime.now().isoformat(timespec='seconds'),
+        "watcher": type(watcher).__name__,
+        "runs": 0,
+        "errors": 0,
+        "last_run": None,
+        "last_duration": None,
+        "last_log": None,
+        "last_error": None,
+        "failed_logs": [],
+    }
+
+    threading.Thread(target=serve_status, args=(server, status), daemon=True).start()
+
+    # size and mtime of pending logs seen by previous run
+    seen = dict()
+    try:
+        unsettled = run_analyze(config, template_path, seen, status)
+        while True:
+            fds = [] if watcher.fileno() is None else [watcher]
+            timeout = config["SETTLE_INTERVAL"] if unsettled else config["POLL_INTERVAL"]
+            select.select(fds, [], [], timeout)
+            watcher.changed()
+
+            # re-create lost watch, switch from polling when log directory appears
+            if watcher.broken:
+                watcher.close()
+                watcher = make_watcher(config["LOG_DIR"])
+                status["watcher"] = type(watcher).__name__
+
+            # rescan is cheap, so it is done after timeout too to catch events inotify missed
+            unsettled = run_analyze(config, template_path, seen, status)
+    finally:
+        logging.info(f'Stop log analyzer daemon')
+        watcher.close()
+        server.close()
+        # socket file may be replaced by another daemon after ours was removed
+        try:
+            if path.samestat(os.stat(config["SOCKET"]), socket_stat):
+                os.remove(config["SOCKET"])
+        except FileNotFoundError:
+            pass
+
+
 def main():
     # parse command line arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', default='config.ini', help='Path to configuration file')
+    parser.add_argument('--daemon', action='store_true', help='Keep running and process new logs as they appear')
     args = parser.parse_args()
 
     # get configuration filename
@@ -239,17 +549,13 @@ def main():
 
     # log processing
     try:
-        logging.info(f'Start log analyzer')
-
-        log = get_log(config["LOG_DIR"])
-        logging.debug(f'log = {log}')
-
-        if log is not None:
-            process_log(config, log, template_path)
+        if args.daemon:
+            logging.info(f'Start log analyzer daemon')
+            serve(config, template_path)
         else:
-            logging.info(f'No logs found')
-
-        logging.info(f'Log analyzer successfully completed')
+            logging.info(f'Start log analyzer')
+            analyze(config, template_path)
+            logging.info(f'Log analyzer successfully completed')
     except Exception as e:
         print(f'Log analyzer stopped with error: {e}')
         logging.exception(e)
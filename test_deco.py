@@ -0,0 +1,229 @@
+import unittest
+import asyncio
+import json
+import time
+import deco
+
+
+class TestAsyncMemo(unittest.TestCase):
+    """Class for testing memo and countcalls applied to coroutine functions"""
+    def setUp(self) -> None:
+        """Create memoized coroutine function counting backend calls"""
+        self.backend_calls = 0
+
+        @deco.memo
+        async def fetch(key):
+            self.backend_calls += 1
+            await asyncio.sleep(0.01)
+            if key < 0:
+                raise ValueError(key)
+            return key * 10
+
+        self.fetch = fetch
+
+    def test_concurrent_calls_coalesced(self):
+        """concurrent calls with the same arguments share one backend call, result is cached"""
+        async def run():
+            return await asyncio.gather(self.fetch(1), self.fetch(1), self.fetch(2))
+
+        self.assertEqual(asyncio.run(run()), [10, 10, 20])
+        self.assertEqual(self.backend_calls, 2)
+        self.assertEqual(asyncio.run(self.fetch(1)), 10)
+        self.assertEqual(self.backend_calls, 2)
+
+    def test_exception_not_cached(self):
+        """failed call is shared by concurrent callers but not cached"""
+        async def run():
+            return await asyncio.gather(self.fetch(-1), self.fetch(-1), return_exceptions=True)
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(self.backend_calls, 1)
+        with self.assertRaises(ValueError):
+            asyncio.run(self.fetch(-1))
+        self.assertEqual(self.backend_calls, 2)
+
+    def test_cancelled_caller(self):
+        """cancelling one caller doesn't cancel the call shared with others"""
+        async def run():
+            first = asyncio.ensure_future(self.fetch(3))
+            second = asyncio.ensure_future(self.fetch(3))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(asyncio.run(run()), 30)
+        self.assertEqual(self.backend_calls, 1)
+
+    def test_countcalls(self):
+        """countcalls keeps coroutine function awaitable and counts calls"""
+        @deco.countcalls
+        async def double(x):
+            return x * 2
+
+        self.assertEqual(asyncio.run(double(2)), 4)
+        self.assertEqual(double.calls, 1)
+
+
+class TestNAry(unittest.TestCase):
+    """Class for testing n_ary decorator"""
+    def test_fold(self):
+        """arguments are folded from the right"""
+        sub = deco.n_ary(lambda a, b: a - b)
+        self.assertEqual(sub(1), 1)
+        self.assertEqual(sub(10, 3, 2), 9)
+
+    def test_long_arguments(self):
+        """argument list longer than recursion limit is supported"""
+        add = deco.n_ary(lambda a, b: a + b)
+        self.assertEqual(add(*range(100000)), sum(range(100000)))
+
+    def test_memoize(self):
+        """only the full call is cached, unhashable arguments are passed through"""
+        calls = []
+
+        @deco.n_ary(memoize=True)
+        def add(a, b):
+            calls.append((a, b))
+            return a + b
+
+        self.assertEqual(add(1, 2, 3), 6)
+        self.assertEqual(add(1, 2, 3), 6)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(add(*range(100000)), sum(range(100000)))
+        self.assertEqual(add([1], [2], [3]), [1, 2, 3])
+        self.assertEqual(add([1], [2], [3]), deco.n_ary(lambda a, b: a + b)([1], [2], [3]))
+
+
+class TestProfile(unittest.TestCase):
+    """Class for testing profile decorator and its registry"""
+    def tearDown(self) -> None:
+        """Remove test entries from profile registry"""
+        for name in [n for n in deco.profile_registry if n.startswith('test.')]:
+            del deco.profile_registry[name]
+
+    def test_recursion(self):
+        """cumulative time of recursive function is counted once per outermost call"""
+        @deco.profile(name='test.countdown')
+        def countdown(n):
+            time.sleep(0.001)
+            return n if n == 0 else countdown(n - 1)
+
+        start = time.perf_counter_ns()
+        countdown(20)
+        wall = time.perf_counter_ns() - start
+
+        stats = deco.profile_stats()['test.countdown']
+        self.assertEqual((stats['calls'], stats['sampled'], stats['primitive']), (21, 21, 1))
+        self.assertLessEqual(stats['cum_ns'], wall)
+        self.assertLessEqual(stats['self_ns'], stats['cum_ns'])
+        self.assertEqual(stats['avg_ns'], stats['cum_ns'])
+
+    def test_self_time(self):
+        """self time excludes time of nested profiled calls"""
+        @deco.profile(name='test.inner')
+        def inner():
+            time.sleep(0.01)
+
+        @deco.profile(name='test.outer')
+        def outer():
+            inner()
+
+        outer()
+        stats = deco.profile_stats()
+        self.assertGreaterEqual(stats['test.outer']['cum_ns'], stats['test.inner']['cum_ns'])
+        self.assertLess(stats['test.outer']['self_ns'], stats['test.inner']['self_ns'])
+
+    def test_sampling(self):
+        """every call is counted, every sample_rate-th call is timed"""
+        @deco.profile(sample_rate=3, histogram=True, name='test.noop')
+        def noop():
+            pass
+
+        for _ in range(10):
+            noop()
+        stats = deco.profile_stats()['test.noop']
+        self.assertEqual((stats['calls'], stats['sampled']), (10, 3))
+        self.assertEqual(sum(stats['histogram'].values()), 3)
+
+    def test_invalid_arguments(self):
+        """zero sample rate and duplicate names are rejected"""
+        with self.assertRaises(ValueError):
+            deco.profile(sample_rate=0)
+
+        deco.profile(name='test.dup')(lambda: None)
+        with self.assertRaises(ValueError):
+            deco.profile(histogram=True, name='test.dup')(lambda: None)
+
+    def test_coroutine(self):
+        """await of coroutine function is timed"""
+        @deco.profile(name='test.wait')
+        async def wait():
+            await asyncio.sleep(0.05)
+
+        asyncio.run(wait())
+        stats = deco.profile_stats()['test.wait']
+        self.assertEqual(stats['primitive'], 1)
+        self.assertGreaterEqual(stats['cum_ns'], 50_000_000)
+
+    def test_keyword_arguments(self):
+        """keyword arguments are passed to profiled functions"""
+        @deco.profile(name='test.kw')
+        def kw(a, b=0):
+            return a + b
+
+        @deco.profile(name='test.async_kw')
+        async def async_kw(a, b=0):
+            return a + b
+
+        self.assertEqual(kw(1, b=2), 3)
+        self.assertEqual(asyncio.run(async_kw(1, b=2)), 3)
+
+    def test_generator(self):
+        """iteration of generator is timed, send and throw are passed to generator"""
+        @deco.profile(name='test.gen')
+        def gen(n, delay=0.01):
+            received = []
+            for i in range(n):
+                try:
+                    received.append((yield i))
+                except ValueError:
+                    received.append('error')
+                time.sleep(delay)
+            return received
+
+        self.assertEqual(list(gen(3)), [0, 1, 2])
+        stats = deco.profile_stats()['test.gen']
+        self.assertEqual((stats['calls'], stats['primitive']), (1, 1))
+        self.assertGreaterEqual(stats['cum_ns'], 30_000_000)
+        self.assertGreaterEqual(stats['self_ns'], 30_000_000)
+
+        g = gen(3, delay=0)
+        self.assertEqual(next(g), 0)
+        self.assertEqual(g.send('a'), 1)
+        self.assertEqual(g.throw(ValueError), 2)
+        with self.assertRaises(StopIteration) as cm:
+            g.send('c')
+        self.assertEqual(cm.exception.value, ['a', 'error', 'c'])
+
+        g = gen(3, delay=0)
+        next(g)
+        g.close()
+        self.assertEqual(deco.profile_stats()['test.gen']['sampled'], 3)
+
+    def test_import(self):
+        """importing deco doesn't register demo functions"""
+        self.assertFalse([n for n in deco.profile_registry if n.startswith('deco.')])
+
+    def test_json(self):
+        """registry is exported as JSON"""
+        @deco.profile(name='test.json')
+        def noop():
+            pass
+
+        noop()
+        self.assertEqual(json.loads(deco.profile_json())['test.json']['calls'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,10 @@
 import unittest
 import log_analyzer
 from datetime import datetime
-from os import path, makedirs, remove
+from os import path, makedirs, remove, listdir
 import shutil
+import json
+import socket
 
 
 class TestHelperFunctions(unittest.TestCase):
@@ -136,5 +138,192 @@ class TestHelperFunctions(unittest.TestCase):
         remove(config_path)
 
 
+class TestDaemon(unittest.TestCase):
+    """Class for testing daemon mode helpers: configure, watchers, status socket"""
+    def setUp(self) -> None:
+        """Create temp directory"""
+        self.dir = path.join("./", "test_tmp")
+        makedirs(self.dir)
+
+    def tearDown(self) -> None:
+        """Remove temp directory with all contents if any"""
+        shutil.rmtree(self.dir)
+
+    def test_configure_daemon(self):
+        """test configure function, daemon section updates POLL_INTERVAL and SOCKET"""
+        config_path = path.join(self.dir, 'config.ini')
+        with open(config_path, 'w') as ini:
+            ini.write("[daemon]\n")
+            ini.write("POLL_INTERVAL=5\n")
+            ini.write("SETTLE_INTERVAL=1\n")
+            ini.write("SOCKET=./s.sock\n")
+
+        conf = {"POLL_INTERVAL": 60, "SETTLE_INTERVAL": 5, "SOCKET": "./log_analyzer.sock"}
+        log_analyzer.configure(config_path, conf)
+        self.assertEqual(conf, {"POLL_INTERVAL": 5.0, "SETTLE_INTERVAL": 1.0, "SOCKET": "./s.sock"})
+
+    def write_log(self, name, mode='w', urls=12):
+        """Write log line for each of urls"""
+        line = '1.1.1.1 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/{} HTTP/1.1" 200 927 "-" "Lynx/2.8.8dev.9" ' \
+               '"-" "1498697422-2190034393-4708-9752759" "dc7161be3" 0.390\n'
+        with open(path.join(self.dir, 'log', name), mode) as log:
+            log.writelines(line.format(i) for i in range(urls))
+
+    def daemon_config(self):
+        makedirs(path.join(self.dir, 'log'))
+        return {
+            "REPORT_SIZE": 1000,
+            "REPORT_DIR": path.join(self.dir, 'reports'),
+            "LOG_DIR": path.join(self.dir, 'log'),
+            "ERROR_LIMIT": 0.5,
+            "SETTLE_INTERVAL": 0,
+        }
+
+    def read_report(self, name):
+        with open(path.join(self.dir, 'reports', name), encoding='windows-1251') as report:
+            return report.read()
+
+    def test_analyze_pending(self):
+        """log is processed only when it stopped changing, every log without report is processed"""
+        conf = self.daemon_config()
+        template_path = path.join(path.dirname(__file__), 'report.html')
+        seen = {}
+
+        self.write_log('nginx-access-ui.log-20170630')
+        self.write_log('nginx-access-ui.log-20170701')
+        processed, unsettled, errors = log_analyzer.analyze_pending(conf, template_path, seen)
+        self.assertEqual((processed, len(unsettled), errors), ([], 2, []))
+
+        # appended log is still changing, the other one is processed
+        self.write_log('nginx-access-ui.log-20170630', mode='a')
+        processed, unsettled, errors = log_analyzer.analyze_pending(conf, template_path, seen)
+        self.assertEqual([log.name for log in processed], ['nginx-access-ui.log-20170701'])
+        self.assertEqual([log.name for log in unsettled], ['nginx-access-ui.log-20170630'])
+
+        processed, unsettled, errors = log_analyzer.analyze_pending(conf, template_path, seen)
+        self.assertEqual([log.name for log in processed], ['nginx-access-ui.log-20170630'])
+        self.assertEqual((unsettled, errors), ([], []))
+
+        report = self.read_report('report-2017.06.30.html')
+        self.assertIn('"count": 2', report)
+        self.assertNotIn('"count": 1,', report)
+        self.assertIn('"count": 1,', self.read_report('report-2017.07.01.html'))
+        self.assertEqual(sorted(listdir(path.join(self.dir, 'reports'))),
+                         ['report-2017.06.30.html', 'report-2017.07.01.html'])
+
+        # nothing left to process
+        self.assertEqual(log_analyzer.analyze_pending(conf, template_path, seen), ([], [], []))
+
+        # unchanged log is processed only after settle interval
+        conf["SETTLE_INTERVAL"] = 60
+        self.write_log('nginx-access-ui.log-20170702')
+        log_analyzer.analyze_pending(conf, template_path, seen)
+        processed, unsettled, errors = log_analyzer.analyze_pending(conf, template_path, seen)
+        self.assertEqual((processed, len(unsettled)), ([], 1))
+
+    def test_analyze_pending_failed(self):
+        """short log is processed, failed log is not processed again until it changes"""
+        conf = self.daemon_config()
+        template_path = path.join(path.dirname(__file__), 'report.html')
+        seen = {}
+
+        self.write_log('nginx-access-ui.log-20170630', urls=3)
+        with open(path.join(self.dir, 'log', 'nginx-access-ui.log-20170701'), 'w') as log:
+            log.write('garbage\n')
+
+        log_analyzer.analyze_pending(conf, template_path, seen)
+        processed, unsettled, errors = log_analyzer.analyze_pending(conf, template_path, seen)
+        self.assertEqual([log.name for log in processed], ['nginx-access-ui.log-20170630'])
+        self.assertEqual(len(errors), 1)
+        self.assertIn('"count": 1,', self.read_report('report-2017.06.30.html'))
+
+        # failed log is skipped
+        self.assertEqual(log_analyzer.analyze_pending(conf, template_path, seen), ([], [], []))
+
+        # changed log is processed again when settled
+        self.write_log('nginx-access-ui.log-20170701', mode='a', urls=3)
+        processed, unsettled, errors = log_analyzer.analyze_pending(conf, template_path, seen)
+        self.assertEqual((processed, len(unsettled), errors), ([], 1, []))
+        processed, unsettled, errors = log_analyzer.analyze_pending(conf, template_path, seen)
+        self.assertEqual([log.name for log in processed], ['nginx-access-ui.log-20170701'])
+        self.assertEqual(errors, [])
+
+    def check_watcher(self, watcher):
+        try:
+            self.assertFalse(watcher.changed())
+            with open(path.join(self.dir, 'nginx-access-ui.log-20170630'), 'w') as log:
+                log.write('line\n')
+            self.assertTrue(watcher.changed())
+            self.assertFalse(watcher.changed())
+        finally:
+            watcher.close()
+
+    def test_polling_watcher(self):
+        """PollingWatcher reports a new file in log directory once"""
+        self.check_watcher(log_analyzer.PollingWatcher(self.dir))
+
+    def test_inotify_watcher(self):
+        """InotifyWatcher reports a new file in log directory once"""
+        try:
+            watcher = log_analyzer.InotifyWatcher(self.dir)
+        except (OSError, AttributeError):
+            self.skipTest('inotify is not available')
+        self.check_watcher(watcher)
+
+    def test_inotify_watcher_broken(self):
+        """InotifyWatcher is broken after log directory is removed, polling watcher after it appears"""
+        log_dir = path.join(self.dir, 'log')
+        makedirs(log_dir)
+        try:
+            watcher = log_analyzer.InotifyWatcher(log_dir)
+        except (OSError, AttributeError):
+            self.skipTest('inotify is not available')
+        try:
+            self.assertFalse(watcher.broken)
+            shutil.rmtree(log_dir)
+            watcher.changed()
+            self.assertTrue(watcher.broken)
+        finally:
+            watcher.close()
+
+        watcher = log_analyzer.PollingWatcher(log_dir)
+        self.assertFalse(watcher.broken)
+        makedirs(log_dir)
+        self.assertTrue(watcher.broken)
+
+    def test_send_status(self):
+        """status is written as JSON line to a client of status socket"""
+        socket_path = path.join(self.dir, 'la.sock')
+        server = log_analyzer.open_status_socket(socket_path)
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(socket_path)
+                log_analyzer.send_status(server, {"status": "ok", "runs": 1})
+                self.assertEqual(json.loads(client.makefile().readline()), {"status": "ok", "runs": 1})
+        finally:
+            server.close()
+
+    def test_open_status_socket(self):
+        """status socket replaces stale socket only, regular files and sockets in use are kept"""
+        socket_path = path.join(self.dir, 'la.sock')
+
+        open(socket_path, 'w').close()
+        with self.assertRaises(log_analyzer.DaemonError):
+            log_analyzer.open_status_socket(socket_path)
+        self.assertTrue(path.isfile(socket_path))
+        remove(socket_path)
+
+        server = log_analyzer.open_status_socket(socket_path)
+        try:
+            with self.assertRaises(log_analyzer.DaemonError):
+                log_analyzer.open_status_socket(socket_path)
+        finally:
+            server.close()
+
+        # socket file of closed server is stale
+        server = log_analyzer.open_status_socket(socket_path)
+        server.close()
+
+
 if __name__ == "__main__":
     unittest.main()